@@ -5,11 +5,20 @@ Handles document loading, chunking, embedding, and retrieval-augmented generatio
 
 import os
 import sys
+import asyncio
 import warnings
 import csv
+import re
+import json
+import hashlib
+import time
+import threading
+import concurrent.futures
 import requests
+from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional, List
+from typing import Optional, List, Tuple, Dict
 from bs4 import BeautifulSoup
 
 # Suppress non-critical warnings
@@ -33,22 +42,57 @@ class SimpleChromaRetriever(BaseRetriever):
     collection: object
     embeddings: object
     k: int = 6
+    snapshot: Optional[dict] = None
+    job_digests: List[dict] = []
 
     class Config:
         arbitrary_types_allowed = True
 
     def get_relevant_documents(self, query: str):
         query_embedding = self.embeddings.embed_query(query)
+        return self.documents_for_query(query, query_embedding)
+
+    def documents_for_query(self, query: str, query_embedding: List[float]):
+        # Questions about several jobs use compact job digests plus the
+        # closest resume chunks instead of raw job description chunks
+        if self.job_digests and is_comparative_question(query):
+            digests = select_job_digests(query, self.job_digests)
+            if digests:
+                docs = []
+                for digest in digests:
+                    if digest.get("summarized"):
+                        docs.append(job_digest_document(digest))
+                    else:
+                        # No digest for this job: use its own closest raw chunks
+                        docs.extend(self.query_by_embedding(
+                            query_embedding, k=DIGEST_FALLBACK_CHUNKS, where=job_chunks_filter(digest)
+                        ))
+                docs.extend(self.query_by_embedding(
+                    query_embedding, k=DIGEST_RESUME_CHUNKS, where={"source_type": "resume"}
+                ))
+                return docs
+        return self.query_by_embedding(query_embedding)
+
+    def query_by_embedding(self, query_embedding: List[float], k: Optional[int] = None, where: Optional[dict] = None):
+        if self.snapshot:
+            problem = check_embedding_dim(self.snapshot["manifest"], len(query_embedding))
+            if problem:
+                raise ValueError(f"Vector store mismatch: {problem}")
+        k = k or self.k
         try:
-            total = self.collection.count()
+            if where and self.snapshot and "source_type" in where:
+                total = self.snapshot["aux"]["source_counts"].get(where["source_type"], 0)
+            else:
+                total = self.collection.count()
         except Exception:
-            total = self.k
-        k = min(self.k, total) if total else 0
+            total = k
+        k = min(k, total) if total else 0
         if k == 0:
             return []
         results = self.collection.query(
             query_embeddings=[query_embedding],
             n_results=k,
+            where=where,
             include=["documents", "metadatas"]
         )
         docs = []
@@ -60,10 +104,105 @@ class SimpleChromaRetriever(BaseRetriever):
 # Configuration
 PERSIST_DIR = "./chroma_db"
 EMBEDDINGS_MODEL = "mxbai-embed-large"
+FALLBACK_EMBEDDINGS_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
 LLM_MODEL = "llama3.2"
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
 
+# Per-source chunking: (chunk_size, chunk_overlap). Sections are split on their
+# own boundaries, so only oversized sections need a small overlap.
+SOURCE_CHUNK_SETTINGS = {
+    "resume": (800, 100),
+    "job_description": (1200, 100),
+}
+
+# Plain-text headings commonly found in resumes and job descriptions. A plain
+# line only counts as a heading if it matches one of these exactly, optionally
+# after one of SECTION_HEADING_PREFIXES ("Key responsibilities").
+SECTION_HEADINGS = (
+    "summary", "profile", "objective", "about", "about the role", "about us", "about you",
+    "experience", "employment", "employment history", "work history",
+    "education", "skills", "projects", "certifications",
+    "responsibilities", "duties", "requirements", "qualifications",
+    "skills and qualifications", "requirements and skills",
+    "nice to have", "benefits", "job brief",
+)
+SECTION_HEADING_PREFIXES = (
+    "key", "core", "main", "required", "preferred", "technical", "professional", "work", "relevant",
+)
+
+# Async query API: max in-flight calls per backend and per-stage timeouts (seconds)
+EMBEDDINGS_CONCURRENCY = 4
+CHROMA_CONCURRENCY = 8
+LLM_CONCURRENCY = 2
+EMBED_TIMEOUT = 30
+RETRIEVE_TIMEOUT = 10
+GENERATE_TIMEOUT = 120
+
+# Process-wide so the limits hold across all sessions, threads and event loops
+# sharing one Ollama/Chroma backend
+_BACKEND_SEMAPHORES = {
+    "embed": threading.BoundedSemaphore(EMBEDDINGS_CONCURRENCY),
+    "retrieve": threading.BoundedSemaphore(CHROMA_CONCURRENCY),
+    "generate": threading.BoundedSemaphore(LLM_CONCURRENCY),
+}
+# Backend calls run on a shared pool rather than each loop's default executor,
+# so an event loop can close without waiting for calls it already timed out on
+_BACKEND_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=32, thread_name_prefix="career-backend")
+_INFLIGHT_QUERIES: Dict[tuple, concurrent.futures.Future] = {}
+_INFLIGHT_LOCK = threading.Lock()
+
+CAREER_PROMPT_TEMPLATE = """
+You are a Career Intelligence Assistant. Analyze the provided resume and job descriptions to answer career-related questions.
+
+For fit/gap analysis: Provide a fit score (0-100%), list matching skills, highlight gaps, and suggest preparation areas.
+For skill matching: Show which skills from the resume align with job requirements.
+For interview prep: Suggest relevant questions and talking points based on the resume and job description.
+
+Be specific and actionable in your responses.
+
+Context:
+{context}
+
+Question: {question}
+
+Answer based on the provided context:"""
+
+# Index snapshot written next to the Chroma data; bump the version whenever the
+# snapshot layout or the meaning of its fields changes
+SNAPSHOT_VERSION = 1
+SNAPSHOT_MANIFEST = "index_manifest.json"
+SNAPSHOT_AUX = "index_aux.json"
+
+# Per-job digests for comparative questions, cached by job content hash
+JOB_DIGESTS_FILE = "job_digests.json"
+DIGEST_MAX_CHARS = 6000
+DIGEST_RESUME_CHUNKS = 2
+DIGEST_FALLBACK_CHUNKS = 2
+# Above this many jobs (or when most lack a digest) the digest path would make
+# the prompt bigger than normal top-k retrieval, so it is skipped
+DIGEST_MAX_JOBS = 10
+# Questions explicitly about several jobs: "all/each/every job", "which role",
+# "compare the jobs"; two or more "Job N" mentions are detected separately
+MULTI_JOB_QUESTION_PATTERN = re.compile(
+    r"\b(all|each|every|both)\s+(of\s+)?(the\s+|these\s+|my\s+)?(jobs?|roles?|positions?)\b"
+    r"|\bwhich\s+(of\s+the\s+)?(jobs?|roles?|positions?)\b"
+    r"|\b(compare|comparing|comparison|versus|vs\.?)\b.*\b(jobs|roles|positions)\b",
+    re.IGNORECASE
+)
+JOB_REFERENCE_PATTERN = re.compile(r"\bjob\s*#?\s*(\d+)\b", re.IGNORECASE)
+
+JOB_DIGEST_PROMPT_TEMPLATE = """
+Summarize the job description below as a JSON object with exactly these keys:
+"title" (string), "seniority" (string, e.g. junior, mid, senior, lead),
+"required_skills" (list of short strings), "nice_to_have_skills" (list of short strings),
+"years_experience" (string, e.g. "3+", or "" if not stated).
+
+Job description:
+{job}
+
+JSON:"""
+
 os.makedirs(PERSIST_DIR, exist_ok=True)
 
 
@@ -184,6 +323,409 @@ def load_job_urls(urls: List[str]) -> List[Document]:
     return docs
 
 
+def _detect_section_heading(line: str) -> Optional[str]:
+    """Return the heading text if the line looks like a section heading."""
+    line = line.strip()
+    if not line:
+        return None
+
+    # Markdown headers: "## Requirements"
+    match = re.match(r"^#{1,6}\s+(.+?)\s*#*$", line)
+    if match:
+        return match.group(1).strip().rstrip(":")
+
+    # Whole-line bold: "**Responsibilities**"
+    match = re.match(r"^\*\*(.+?)\*\*:?$", line)
+    if match:
+        return match.group(1).strip().rstrip(":")
+
+    # Plain headings: "Required skills", "EXPERIENCE", "Tech stack:" (but not
+    # "Skills: Python, SQL" or "Strong communication skills")
+    if line.startswith(("-", "*", "•")) or len(line) > 60 or len(line.split()) > 6:
+        return None
+    if ":" in line[:-1] or line.endswith("."):
+        return None
+    heading = line.rstrip(":").strip()
+    if line.endswith(":") or (heading.isupper() and any(c.isalpha() for c in heading)):
+        return heading
+    words = heading.lower().split()
+    if " ".join(words) in SECTION_HEADINGS:
+        return heading
+    if len(words) > 1 and words[0] in SECTION_HEADING_PREFIXES and " ".join(words[1:]) in SECTION_HEADINGS:
+        return heading
+    return None
+
+
+def split_into_sections(text: str) -> List[Tuple[str, str]]:
+    """
+    Split text into (section, content) pairs on detected headings.
+    Text before the first heading is returned under the "overview" section.
+    """
+    sections: List[Tuple[str, str]] = []
+    current_section = "overview"
+    current_lines: List[str] = []
+
+    for line in text.splitlines():
+        heading = _detect_section_heading(line)
+        if heading:
+            content = "\n".join(current_lines).strip()
+            if content:
+                sections.append((current_section, content))
+            current_section = heading
+            current_lines = [line]
+        else:
+            current_lines.append(line)
+
+    content = "\n".join(current_lines).strip()
+    if content:
+        sections.append((current_section, content))
+    return sections
+
+
+def chunk_documents(docs: List[Document]) -> List[Document]:
+    """
+    Section-aware chunking with chunk sizes chosen per source type.
+    Small documents (e.g. CSV rows) are kept whole. Larger ones are split on
+    Markdown/resume section headings, adjacent sections are merged until the
+    next one would exceed the chunk size, and only sections that are too large
+    on their own are split further. Every chunk is tagged with
+    metadata['section'] ("full" for whole documents, otherwise the section
+    headings it covers joined with " | ").
+    """
+    chunks: List[Document] = []
+    for doc in docs:
+        source_type = doc.metadata.get("source_type", "")
+        chunk_size, chunk_overlap = SOURCE_CHUNK_SETTINGS.get(source_type, (CHUNK_SIZE, CHUNK_OVERLAP))
+        text = doc.page_content.strip()
+        if not text:
+            continue
+
+        if len(text) <= chunk_size:
+            chunks.append(Document(page_content=text, metadata={**doc.metadata, "section": "full"}))
+            continue
+
+        def add_chunk(content: str, section_names: List[str]) -> None:
+            chunks.append(Document(page_content=content, metadata={**doc.metadata, "section": " | ".join(section_names)}))
+
+        splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        group_parts: List[str] = []
+        group_sections: List[str] = []
+        for section, content in split_into_sections(text):
+            merged = "\n\n".join(group_parts + [content])
+            if len(merged) <= chunk_size:
+                group_parts.append(content)
+                group_sections.append(section)
+                continue
+
+            if group_parts:
+                add_chunk("\n\n".join(group_parts), group_sections)
+                group_parts, group_sections = [], []
+
+            if len(content) <= chunk_size:
+                group_parts, group_sections = [content], [section]
+            else:
+                pieces = splitter.split_text(content)
+                # Keep the heading on continuation chunks so they stay self-describing
+                pieces = [pieces[0]] + [f"{section}\n{piece}" for piece in pieces[1:]]
+                for piece in pieces:
+                    add_chunk(piece, [section])
+
+        if group_parts:
+            add_chunk("\n\n".join(group_parts), group_sections)
+
+    return chunks
+
+
+@lru_cache(maxsize=None)
+def get_chroma_client(persist_dir: str = PERSIST_DIR):
+    """Return a process-wide Chroma client so restarts within a process reuse it."""
+    return chromadb.Client(Settings(chroma_db_impl="duckdb+parquet", persist_directory=persist_dir))
+
+
+def create_embeddings(model_name: str) -> object:
+    """Create the embeddings backend for a model recorded at ingestion time."""
+    if model_name == FALLBACK_EMBEDDINGS_MODEL:
+        from langchain.embeddings import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name=model_name)
+    return OllamaEmbeddings(model=model_name)
+
+
+def corpus_hash(splits: List[Document]) -> str:
+    """Stable hash of chunk texts and metadata, used to detect stale snapshots."""
+    digest = hashlib.sha256()
+    for doc in splits:
+        digest.update(doc.page_content.encode("utf-8"))
+        digest.update(json.dumps(doc.metadata, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _write_json(path: Path, data: dict) -> None:
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def write_index_snapshot(
+    splits: List[Document],
+    embedding_model: str,
+    embedding_dim: int,
+    persist_dir: str = PERSIST_DIR
+) -> dict:
+    """
+    Write the versioned index snapshot alongside the vector store.
+    
+    Args:
+        splits: Chunks that were embedded, in collection order
+        embedding_model: Name of the embedding model used
+        embedding_dim: Dimension of the stored vectors
+        persist_dir: Vector store directory
+    
+    Returns:
+        The manifest that was written
+    """
+    source_counts: Dict[str, int] = {}
+    for doc in splits:
+        source_type = doc.metadata.get("source_type", "unknown")
+        source_counts[source_type] = source_counts.get(source_type, 0) + 1
+
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "embedding_model": embedding_model,
+        "embedding_dim": embedding_dim,
+        "chunking": {
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+            "source_settings": {source: list(settings) for source, settings in SOURCE_CHUNK_SETTINGS.items()},
+        },
+        "corpus_hash": corpus_hash(splits),
+        "collection_count": len(splits),
+    }
+    aux = {
+        "source_counts": source_counts,
+    }
+
+    # Manifest goes last so a crash mid-write never leaves a valid-looking snapshot
+    persist_path = Path(persist_dir)
+    _write_json(persist_path / SNAPSHOT_AUX, aux)
+    _write_json(persist_path / SNAPSHOT_MANIFEST, manifest)
+    return manifest
+
+
+def load_index_snapshot(persist_dir: str = PERSIST_DIR) -> Optional[dict]:
+    """
+    Load the index snapshot written by ingest_documents().
+    
+    Returns:
+        Dict with "manifest" and "aux" keys, or None if the snapshot is
+        missing, unreadable or from an incompatible snapshot version
+    """
+    persist_path = Path(persist_dir)
+    try:
+        with open(persist_path / SNAPSHOT_MANIFEST, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != SNAPSHOT_VERSION:
+            print(f"Index snapshot version {manifest.get('version')} is not supported (expected {SNAPSHOT_VERSION}).")
+            return None
+        with open(persist_path / SNAPSHOT_AUX, encoding="utf-8") as f:
+            aux = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return {"manifest": manifest, "aux": aux}
+
+
+def check_index_snapshot(manifest: dict, collection_count: int) -> Optional[str]:
+    """Return the reason the stored index can't be used as-is, or None if it can."""
+    embedding_model = manifest.get("embedding_model")
+    if embedding_model not in (EMBEDDINGS_MODEL, FALLBACK_EMBEDDINGS_MODEL):
+        return (
+            f"index was embedded with '{embedding_model}' but the configured model is "
+            f"'{EMBEDDINGS_MODEL}'; re-ingest the documents"
+        )
+    if manifest.get("collection_count") != collection_count:
+        return (
+            f"snapshot lists {manifest.get('collection_count')} chunks but the collection has "
+            f"{collection_count}; re-ingest the documents"
+        )
+    return None
+
+
+def check_embedding_dim(manifest: dict, embedding_dim: int) -> Optional[str]:
+    """Return the reason query vectors don't fit the stored index, or None if they do."""
+    expected_dim = manifest.get("embedding_dim")
+    if expected_dim and expected_dim != embedding_dim:
+        return (
+            f"query embeddings have {embedding_dim} dimensions but the index was built with "
+            f"{expected_dim}; re-ingest the documents"
+        )
+    return None
+
+
+def is_comparative_question(query: str) -> bool:
+    """Return True for questions that refer to several jobs or to all jobs."""
+    if len(set(JOB_REFERENCE_PATTERN.findall(query))) >= 2:
+        return True
+    return bool(MULTI_JOB_QUESTION_PATTERN.search(query))
+
+
+def select_job_digests(query: str, job_digests: List[dict]) -> List[dict]:
+    """
+    Pick the digests a multi-job question needs.
+    Explicit "Job N" mentions select only those jobs; otherwise all jobs are
+    used. Returns an empty list when the selection exceeds DIGEST_MAX_JOBS or
+    most selected jobs have no digest, so callers use normal retrieval instead.
+    """
+    referenced = {int(job_id) for job_id in JOB_REFERENCE_PATTERN.findall(query)}
+    if referenced:
+        selected = [digest for digest in job_digests if digest.get("job_id") in referenced]
+    else:
+        selected = list(job_digests)
+    if not selected or len(selected) > DIGEST_MAX_JOBS:
+        return []
+    unsummarized = sum(1 for digest in selected if not digest.get("summarized"))
+    if unsummarized * 2 > len(selected):
+        return []
+    return selected
+
+
+def _parse_job_digest(text: str) -> dict:
+    """Parse the LLM's JSON digest, tolerating surrounding prose."""
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    data = json.loads(match.group(0) if match else text)
+
+    def as_list(value) -> List[str]:
+        if isinstance(value, str):
+            value = re.split(r"[,;\n]", value)
+        return [str(item).strip() for item in value or [] if str(item).strip()]
+
+    return {
+        "title": str(data.get("title") or "").strip(),
+        "seniority": str(data.get("seniority") or "").strip(),
+        "required_skills": as_list(data.get("required_skills")),
+        "nice_to_have_skills": as_list(data.get("nice_to_have_skills")),
+        "years_experience": str(data.get("years_experience") or "").strip(),
+    }
+
+
+def group_job_documents(docs: List[Document]) -> List[Tuple[dict, str]]:
+    """
+    Group job description documents (e.g. PDF pages) into one text per job.
+    
+    Returns:
+        List of (job metadata, full job text) in load order
+    """
+    jobs: Dict[tuple, Tuple[dict, List[str]]] = {}
+    for doc in docs:
+        if doc.metadata.get("source_type") != "job_description":
+            continue
+        key = (doc.metadata.get("job_id"), doc.metadata.get("filename"), doc.metadata.get("url"))
+        if key not in jobs:
+            jobs[key] = ({
+                "job_id": doc.metadata.get("job_id"),
+                "filename": doc.metadata.get("filename"),
+                "url": doc.metadata.get("url"),
+            }, [])
+        jobs[key][1].append(doc.page_content)
+    return [(info, "\n".join(parts).strip()) for info, parts in jobs.values()]
+
+
+def build_job_digests(
+    docs: List[Document],
+    llm: Optional[object] = None,
+    persist_dir: str = PERSIST_DIR,
+    corpus_hash: Optional[str] = None
+) -> List[dict]:
+    """
+    Create or reuse a compact digest for every job description.
+    Digests are cached by the job's content hash, so only new or changed jobs
+    are sent to the LLM. Jobs that could not be summarized are kept with
+    summarized=False so retrieval can fall back to their raw chunks, and are
+    retried on the next ingestion.
+    
+    Args:
+        docs: Loaded (unchunked) documents; non-job documents are ignored
+        llm: Chat model used for summarization (defaults to ChatOllama)
+        persist_dir: Vector store directory holding the digest cache
+        corpus_hash: Corpus hash of the index snapshot these digests belong to
+    
+    Returns:
+        List of digest dicts in job load order
+    """
+    cache_path = Path(persist_dir) / JOB_DIGESTS_FILE
+    cached = {
+        digest["content_hash"]: digest
+        for digest in load_job_digests(persist_dir)
+        if digest.get("summarized")
+    }
+    prompt = ChatPromptTemplate.from_template(JOB_DIGEST_PROMPT_TEMPLATE)
+
+    digests: List[dict] = []
+    for info, text in group_job_documents(docs):
+        content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        if content_hash in cached:
+            digest = {**cached[content_hash], **info}
+        else:
+            if llm is None:
+                llm = ChatOllama(model=LLM_MODEL, temperature=0, format="json")
+            try:
+                messages = prompt.format_messages(job=text[:DIGEST_MAX_CHARS])
+                fields = _parse_job_digest(llm.invoke(messages).content)
+            except Exception as e:
+                print(f"  Could not summarize job {info['job_id']}: {e}")
+                digests.append({**info, "content_hash": content_hash, "summarized": False})
+                continue
+            digest = {**info, "content_hash": content_hash, "summarized": True, **fields}
+        digests.append(digest)
+
+    _write_json(cache_path, {"corpus_hash": corpus_hash, "digests": digests})
+    return digests
+
+
+def load_job_digests(persist_dir: str = PERSIST_DIR, corpus_hash: Optional[str] = None) -> List[dict]:
+    """
+    Load cached job digests, or an empty list if none exist.
+    When corpus_hash is given, digests written for a different index snapshot
+    (e.g. ingestion stopped before the digests were rebuilt) are ignored.
+    """
+    try:
+        with open(Path(persist_dir) / JOB_DIGESTS_FILE, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return []
+    if corpus_hash is not None and data.get("corpus_hash") != corpus_hash:
+        print("Job digests belong to a different index snapshot; ignoring them.")
+        return []
+    return data.get("digests", [])
+
+
+def job_chunks_filter(digest: dict) -> dict:
+    """Chroma where-filter selecting the raw chunks of the job a digest describes."""
+    conditions = [{"source_type": "job_description"}, {"job_id": digest.get("job_id")}]
+    for key in ("filename", "url"):
+        if digest.get(key):
+            conditions.append({key: digest[key]})
+    return {"$and": conditions}
+
+
+def job_digest_document(digest: dict) -> Document:
+    """Render a job digest as a small Document for the prompt context."""
+    source = digest.get("filename") or digest.get("url") or "unknown source"
+    lines = [
+        f"Job {digest.get('job_id')} digest ({source})",
+        f"Title: {digest.get('title') or 'Unknown'}",
+        f"Seniority: {digest.get('seniority') or 'Not stated'}",
+        f"Required skills: {', '.join(digest.get('required_skills', [])) or 'Not stated'}",
+        f"Nice-to-have skills: {', '.join(digest.get('nice_to_have_skills', [])) or 'None listed'}",
+        f"Years of experience: {digest.get('years_experience') or 'Not stated'}",
+    ]
+    return Document(page_content="\n".join(lines), metadata={
+        "source_type": "job_digest",
+        "job_id": digest.get("job_id"),
+        "filename": digest.get("filename") or source,
+    })
+
+
 def ingest_documents(resume_path: str, jobs_dir: str, job_urls: Optional[List[str]] = None) -> object:
     """
     Ingest resume and job descriptions into vector store.
@@ -212,13 +754,6 @@ def ingest_documents(resume_path: str, jobs_dir: str, job_urls: Optional[List[st
         all_docs.extend(url_docs)
         print(f"  Successfully scraped: {len(url_docs)} job(s)")
     
-    # Load job descriptions
-    print(f"Loading resume from {resume_path}...")
-    resume_docs = load_document(resume_path)
-    for doc in resume_docs:
-        doc.metadata['source_type'] = 'resume'
-    all_docs.extend(resume_docs)
-    
     # Load job descriptions
     jobs_path = Path(jobs_dir)
     if jobs_path.exists():
@@ -254,50 +789,79 @@ def ingest_documents(resume_path: str, jobs_dir: str, job_urls: Optional[List[st
     
     # Chunk documents
     print("Chunking documents...")
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP
-    )
-    splits = splitter.split_documents(all_docs)
+    splits = chunk_documents(all_docs)
     print(f"Total chunks created: {len(splits)}")
     
     # Embed and store in Chroma
     print("Embedding documents and storing in vector DB...")
     try:
-        embeddings = OllamaEmbeddings(model=EMBEDDINGS_MODEL)
+        embedding_model = EMBEDDINGS_MODEL
+        embeddings = create_embeddings(embedding_model)
         # Test the embeddings by embedding a single document
         test_embed = embeddings.embed_query("test")
         print(f"✅ Using Ollama embeddings ({EMBEDDINGS_MODEL})")
     except Exception as e:
         print(f"⚠️  Warning: Could not connect to Ollama embeddings: {e}")
         print("    Using default SentenceTransformer embeddings instead")
-        from langchain.embeddings import HuggingFaceEmbeddings
-        embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+        embedding_model = FALLBACK_EMBEDDINGS_MODEL
+        embeddings = create_embeddings(embedding_model)
+        test_embed = None
 
-    # Reset existing collection to ensure embedding function is applied
-    client = chromadb.Client(Settings(chroma_db_impl="duckdb+parquet", persist_directory=PERSIST_DIR))
-    try:
-        client.delete_collection(name="career_docs")
-        print("Cleared existing vector store collection.")
-    except Exception:
-        pass
-
-    collection = client.get_or_create_collection(name="career_docs")
-
-    texts = [doc.page_content for doc in splits]
-    metadatas = [doc.metadata for doc in splits]
-    ids = [f"doc_{i}" for i in range(len(splits))]
-    embeddings_list = embeddings.embed_documents(texts)
-
-    collection.add(
-        documents=texts,
-        metadatas=metadatas,
-        ids=ids,
-        embeddings=embeddings_list
+    client = get_chroma_client(PERSIST_DIR)
+    splits_hash = corpus_hash(splits)
+    collection = None
+    snapshot = None
+
+    # Skip re-embedding when the same chunks were already embedded with this model
+    previous = load_index_snapshot(PERSIST_DIR)
+    if previous and previous["manifest"].get("corpus_hash") == splits_hash \
+            and previous["manifest"].get("embedding_model") == embedding_model:
+        existing = client.get_or_create_collection(name="career_docs")
+        if check_index_snapshot(previous["manifest"], existing.count()) is None:
+            print("Corpus unchanged since last ingestion; reusing stored embeddings.")
+            collection, snapshot = existing, previous
+
+    if collection is None:
+        # Reset existing collection to ensure embedding function is applied
+        try:
+            client.delete_collection(name="career_docs")
+            print("Cleared existing vector store collection.")
+        except Exception:
+            pass
+
+        collection = client.get_or_create_collection(name="career_docs")
+
+        texts = [doc.page_content for doc in splits]
+        metadatas = [doc.metadata for doc in splits]
+        ids = [f"doc_{i}" for i in range(len(splits))]
+        embeddings_list = embeddings.embed_documents(texts)
+
+        collection.add(
+            documents=texts,
+            metadatas=metadatas,
+            ids=ids,
+            embeddings=embeddings_list
+        )
+        client.persist()
+
+        embedding_dim = len(embeddings_list[0]) if embeddings_list else len(test_embed or [])
+        write_index_snapshot(splits, embedding_model, embedding_dim, PERSIST_DIR)
+        snapshot = load_index_snapshot(PERSIST_DIR)
+
+    print("Building job digests...")
+    job_digests = build_job_digests(
+        all_docs, persist_dir=PERSIST_DIR, corpus_hash=snapshot["manifest"]["corpus_hash"] if snapshot else None
     )
+    print(f"  Job digests ready: {len(job_digests)}")
     
     print("Documents ingested successfully!")
-    return SimpleChromaRetriever(collection=collection, embeddings=embeddings, k=6)
+    return SimpleChromaRetriever(
+        collection=collection,
+        embeddings=embeddings,
+        k=6,
+        snapshot=snapshot,
+        job_digests=job_digests
+    )
 
 
 def create_rag_chain(retriever: object):
@@ -320,34 +884,152 @@ def create_rag_chain(retriever: object):
         retriever=retriever,
         return_source_documents=True,
         chain_type_kwargs={
-            "prompt": ChatPromptTemplate.from_template("""
-You are a Career Intelligence Assistant. Analyze the provided resume and job descriptions to answer career-related questions.
+            "prompt": ChatPromptTemplate.from_template(CAREER_PROMPT_TEMPLATE)
+        }
+    )
+    
+    return rag_chain
 
-For fit/gap analysis: Provide a fit score (0-100%), list matching skills, highlight gaps, and suggest preparation areas.
-For skill matching: Show which skills from the resume align with job requirements.
-For interview prep: Suggest relevant questions and talking points based on the resume and job description.
 
-Be specific and actionable in your responses.
+class AsyncQueryService:
+    """
+    Asyncio query API for the embed -> retrieve -> generate flow.
 
-Context:
-{context}
+    Identical in-flight questions against the same index and LLM are
+    coalesced into a single execution, even across threads and event loops
+    (e.g. concurrent Streamlit sessions). Each backend (embeddings, Chroma,
+    LLM) is guarded by a process-wide bounded semaphore so excess requests
+    wait instead of overloading Ollama, and every stage has its own timeout.
+    """
 
-Question: {question}
+    def __init__(self, retriever: object, llm: Optional[object] = None, temperature: float = 0.1):
+        self.retriever = retriever
+        self.llm = llm or ChatOllama(model=LLM_MODEL, temperature=temperature)
+        self.prompt = ChatPromptTemplate.from_template(CAREER_PROMPT_TEMPLATE)
+        self.timeouts = {
+            "embed": EMBED_TIMEOUT,
+            "retrieve": RETRIEVE_TIMEOUT,
+            "generate": GENERATE_TIMEOUT,
+        }
 
-Answer based on the provided context:""")
+    def _coalesce_scope(self) -> tuple:
+        # Services over the same index and LLM settings give the same answer,
+        # so their questions can share one execution
+        snapshot = getattr(self.retriever, "snapshot", None)
+        if snapshot:
+            manifest = snapshot["manifest"]
+            return (
+                manifest.get("corpus_hash"),
+                manifest.get("embedding_model"),
+                getattr(self.llm, "model", None),
+                getattr(self.llm, "temperature", None),
+            )
+        return ("service", id(self))
+
+    async def aquery(self, question: str) -> dict:
+        """
+        Answer a question, sharing the result with identical in-flight queries.
+
+        Returns:
+            Dict with "query", "result" and "source_documents", matching the
+            output of the RetrievalQA chain.
+        """
+        key = self._coalesce_scope() + (" ".join(question.split()).lower(),)
+        with _INFLIGHT_LOCK:
+            shared = _INFLIGHT_QUERIES.get(key)
+            if shared is None:
+                shared = concurrent.futures.Future()
+                _INFLIGHT_QUERIES[key] = shared
+                task = asyncio.ensure_future(self._execute(question))
+                task.add_done_callback(lambda done: self._publish(key, shared, done))
+        # Shield so one caller cancelling does not cancel the shared execution
+        return await asyncio.shield(asyncio.wrap_future(shared))
+
+    @staticmethod
+    def _publish(key: tuple, shared: concurrent.futures.Future, task: asyncio.Future) -> None:
+        with _INFLIGHT_LOCK:
+            _INFLIGHT_QUERIES.pop(key, None)
+        if task.cancelled():
+            shared.set_exception(RuntimeError("query was cancelled before it completed"))
+        elif task.exception() is not None:
+            shared.set_exception(task.exception())
+        else:
+            shared.set_result(task.result())
+
+    async def _execute(self, question: str) -> dict:
+        query_embedding = await self._run_stage("embed", self.retriever.embeddings.embed_query, question)
+        docs = await self._run_stage("retrieve", self.retriever.documents_for_query, question, query_embedding)
+        context = "\n\n".join(doc.page_content for doc in docs)
+        messages = self.prompt.format_messages(context=context, question=question)
+        response = await self._run_stage("generate", self.llm.invoke, messages)
+        return {
+            "query": question,
+            "result": getattr(response, "content", str(response)),
+            "source_documents": docs,
         }
-    )
-    
-    return rag_chain
+
+    async def _run_stage(self, stage: str, func, *args):
+        timeout = self.timeouts[stage]
+        deadline = time.monotonic() + timeout
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(_BACKEND_EXECUTOR, _call_with_backend_slot, stage, deadline, func, *args)
+        try:
+            return await asyncio.wait_for(future, timeout=timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"{stage} stage timed out after {timeout}s")
+
+
+def _call_with_backend_slot(stage: str, deadline: float, func, *args):
+    """
+    Run a backend call in a worker thread while holding the stage's slot.
+    The slot is released only when the call returns, even if the caller has
+    already timed out, so backpressure reflects the calls Ollama/Chroma are
+    still serving. Waiting for a slot gives up at the caller's deadline.
+    """
+    semaphore = _BACKEND_SEMAPHORES[stage]
+    if not semaphore.acquire(timeout=max(0.0, deadline - time.monotonic())):
+        raise TimeoutError(f"{stage} stage timed out waiting for a free slot")
+    try:
+        return func(*args)
+    finally:
+        semaphore.release()
 
 
 def load_existing_vectorstore() -> Optional[object]:
-    """Load existing vector store if available."""
+    """
+    Load existing vector store if available.
+    The index snapshot decides which embedding model queries must use, and
+    indexes built with a different model or out of sync with the snapshot are
+    rejected instead of being queried with mismatched vectors.
+    """
     try:
-        embeddings = OllamaEmbeddings(model=EMBEDDINGS_MODEL)
-        client = chromadb.Client(Settings(chroma_db_impl="duckdb+parquet", persist_directory=PERSIST_DIR))
+        client = get_chroma_client(PERSIST_DIR)
         collection = client.get_or_create_collection(name="career_docs")
-        return SimpleChromaRetriever(collection=collection, embeddings=embeddings, k=6)
+        count = collection.count()
+        if count == 0:
+            return None
+
+        snapshot = load_index_snapshot(PERSIST_DIR)
+        if snapshot is None:
+            print("⚠️  No index snapshot found; assuming the index uses "
+                  f"{EMBEDDINGS_MODEL}. Re-ingest to enable model checks.")
+            embeddings = create_embeddings(EMBEDDINGS_MODEL)
+            return SimpleChromaRetriever(collection=collection, embeddings=embeddings, k=6)
+
+        manifest = snapshot["manifest"]
+        problem = check_index_snapshot(manifest, count)
+        if problem:
+            print(f"Could not load existing vector store: {problem}")
+            return None
+
+        embeddings = create_embeddings(manifest["embedding_model"])
+        return SimpleChromaRetriever(
+            collection=collection,
+            embeddings=embeddings,
+            k=6,
+            snapshot=snapshot,
+            job_digests=load_job_digests(PERSIST_DIR, corpus_hash=manifest.get("corpus_hash"))
+        )
     except Exception as e:
         print(f"Could not load existing vector store: {e}")
         return None
@@ -4,14 +4,33 @@ Run with: pytest test_rag.py -v
 """
 
 import os
+import time
+import asyncio
+import threading
 import tempfile
 from pathlib import Path
 import pytest
 from langchain_core.documents import Document
+from langchain_core.messages import AIMessage
+from langchain.text_splitter import RecursiveCharacterTextSplitter
 from rag import (
+    SimpleChromaRetriever,
     load_document,
+    split_into_sections,
+    chunk_documents,
     ingest_documents,
     create_rag_chain,
+    AsyncQueryService,
+    LLM_CONCURRENCY,
+    write_index_snapshot,
+    load_index_snapshot,
+    check_index_snapshot,
+    check_embedding_dim,
+    EMBEDDINGS_MODEL,
+    is_comparative_question,
+    build_job_digests,
+    load_job_digests,
+    job_digest_document,
 )
 
 
@@ -63,6 +82,91 @@ def temp_jobs_dir():
     os.rmdir(jobs_dir)
 
 
+class FakeEmbeddings:
+    """Counts embedding calls instead of contacting Ollama."""
+    
+    def __init__(self):
+        self.calls = 0
+    
+    def embed_query(self, query):
+        self.calls += 1
+        return [0.0]
+
+
+class FakeRetriever:
+    def __init__(self):
+        self.embeddings = FakeEmbeddings()
+    
+    def documents_for_query(self, query, query_embedding):
+        return [Document(page_content="Skills: Python", metadata={"source_type": "resume"})]
+
+
+class FakeLLM:
+    def invoke(self, messages):
+        return AIMessage(content="You know Python.")
+
+
+class CountingDigestLLM:
+    """Returns a fixed JSON digest and counts summarization calls."""
+    
+    def __init__(self):
+        self.calls = 0
+    
+    def invoke(self, messages):
+        self.calls += 1
+        return AIMessage(content=(
+            'Here you go: {"title": "ML Engineer", "seniority": "senior", '
+            '"required_skills": ["Python", "PyTorch"], "nice_to_have_skills": "Docker, AWS", '
+            '"years_experience": "5+"}'
+        ))
+
+
+class ConcurrencyRecordingLLM:
+    """Records the peak number of concurrent invoke() calls."""
+    
+    def __init__(self, delay=0.05, release=None):
+        self.delay = delay
+        self.release = release
+        self.calls = 0
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+    
+    def invoke(self, messages):
+        with self.lock:
+            self.calls += 1
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            if self.release is not None:
+                self.release.wait(timeout=5)
+            else:
+                time.sleep(self.delay)
+            return AIMessage(content="Done.")
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+class FailingDigestLLM:
+    def invoke(self, messages):
+        raise ConnectionError("Ollama is not running")
+
+
+class RecordingCollection:
+    """Records where-filters instead of querying Chroma."""
+    
+    def __init__(self):
+        self.queries = []
+    
+    def count(self):
+        return 10
+    
+    def query(self, query_embeddings, n_results, where=None, include=None):
+        self.queries.append(where)
+        return {"documents": [["raw chunk"]], "metadatas": [[{"source_type": "job_description"}]]}
+
+
 class TestDocumentLoading:
     """Test document loading functionality."""
     
@@ -79,6 +183,168 @@ class TestDocumentLoading:
             load_document("file.xyz")
 
 
+class TestChunking:
+    """Test section-aware chunking."""
+    
+    def test_split_into_sections_markdown_and_plain_headings(self):
+        """Test that Markdown, bold and plain headings start new sections."""
+        text = "Intro line\n## Responsibilities\n- Build things\n**Requirements**\n- Python\nNice to have\n- Docker"
+        sections = split_into_sections(text)
+        assert [name for name, _ in sections] == ["overview", "Responsibilities", "Requirements", "Nice to have"]
+        assert "- Python" in sections[2][1]
+    
+    def test_split_into_sections_ignores_inline_labels(self):
+        """Test that 'Skills: Python' style lines are not treated as headings."""
+        sections = split_into_sections("John Doe\nSkills: Python, SQL\nExperience: 8 years")
+        assert len(sections) == 1
+    
+    def test_chunk_documents_keeps_small_docs_whole(self):
+        """Test that short documents become a single chunk tagged 'full'."""
+        doc = Document(page_content="title: ML Engineer\nskills: Python", metadata={"source_type": "job_description"})
+        chunks = chunk_documents([doc])
+        assert len(chunks) == 1
+        assert chunks[0].metadata["section"] == "full"
+        assert chunks[0].metadata["source_type"] == "job_description"
+    
+    def test_split_into_sections_rejects_keyword_lines(self):
+        """Test that short lines merely containing a heading keyword are not headings."""
+        for line in ["Strong communication skills", "5 years experience", "Python skills", "Team projects"]:
+            sections = split_into_sections(f"Intro line\n{line}\nMore text")
+            assert len(sections) == 1, line
+    
+    def test_split_into_sections_caps_and_colon_headings(self):
+        """Test that ALL CAPS and colon-terminated lines start new sections."""
+        sections = split_into_sections("John Doe\nWORK EXPERIENCE\nAcme 2020\nTech stack:\n- Python")
+        assert [name for name, _ in sections] == ["overview", "WORK EXPERIENCE", "Tech stack"]
+    
+    def test_chunk_documents_merges_small_sections(self):
+        """Test that adjacent sections are merged up to the chunk size."""
+        text = "## Responsibilities\n" + "- Build pipelines\n" * 40 + "## Requirements\n" + "- Python and SQL\n" * 60
+        doc = Document(page_content=text, metadata={"source_type": "job_description"})
+        chunks = chunk_documents([doc])
+        assert len(chunks) == 2
+        assert [chunk.metadata["section"] for chunk in chunks] == ["Responsibilities", "Requirements"]
+        assert all(len(chunk.page_content) <= 1200 for chunk in chunks)
+    
+    def test_chunk_documents_splits_oversized_section(self):
+        """Test that a section larger than the chunk size is split on its own."""
+        text = "Intro\n## Responsibilities\n" + "- Build and operate data pipelines\n" * 100
+        doc = Document(page_content=text, metadata={"source_type": "job_description"})
+        chunks = chunk_documents([doc])
+        assert len(chunks) > 1
+        assert all(len(chunk.page_content) <= 1200 + len("Responsibilities\n") for chunk in chunks)
+        assert all(chunk.page_content.startswith(("Intro", "## Responsibilities", "Responsibilities")) for chunk in chunks)
+    
+    def test_chunk_documents_fewer_chunks_on_sample_jds(self):
+        """Test that the sample JDs produce fewer chunks than the old 1000/200 splitter."""
+        docs = [
+            Document(page_content=jd_path.read_text(encoding="utf-8"), metadata={"source_type": "job_description"})
+            for jd_path in sorted((Path(__file__).parent / "JD_Sample_Set").glob("*.md"))
+        ]
+        baseline = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200).split_documents(docs)
+        chunks = chunk_documents(docs)
+        assert len(chunks) < len(baseline)
+        assert sum(len(chunk.page_content) for chunk in chunks) < sum(len(chunk.page_content) for chunk in baseline)
+
+
+class TestAsyncQueryService:
+    """Test the asyncio query API."""
+    
+    def test_identical_queries_are_coalesced(self):
+        """Test that concurrent identical questions share one execution."""
+        retriever = FakeRetriever()
+        service = AsyncQueryService(retriever, llm=FakeLLM())
+        
+        async def run():
+            return await asyncio.gather(
+                service.aquery("What are my Python skills?"),
+                service.aquery("what are my  python skills?"),
+            )
+        
+        first, second = asyncio.run(run())
+        assert first is second
+        assert first["result"] == "You know Python."
+        assert len(first["source_documents"]) == 1
+        assert retriever.embeddings.calls == 1
+    
+    def test_stage_timeout(self):
+        """Test that a slow stage raises TimeoutError."""
+        class SlowLLM:
+            def invoke(self, messages):
+                time.sleep(0.2)
+        
+        service = AsyncQueryService(FakeRetriever(), llm=SlowLLM())
+        service.timeouts["generate"] = 0.05
+        with pytest.raises(TimeoutError):
+            asyncio.run(service.aquery("What is my fit score?"))
+    
+    def test_service_reused_across_event_loops(self):
+        """Test that one service works under successive asyncio.run() calls."""
+        service = AsyncQueryService(FakeRetriever(), llm=FakeLLM())
+        
+        async def run():
+            return await asyncio.gather(*[service.aquery(f"Question {i}") for i in range(6)])
+        
+        assert len(asyncio.run(run())) == 6
+        assert len(asyncio.run(run())) == 6
+    
+    def test_backpressure_limits_concurrent_llm_calls(self):
+        """Test that concurrent distinct questions never exceed the LLM limit."""
+        llm = ConcurrencyRecordingLLM()
+        service = AsyncQueryService(FakeRetriever(), llm=llm)
+        
+        async def run():
+            return await asyncio.gather(*[service.aquery(f"Question {i}") for i in range(LLM_CONCURRENCY * 3)])
+        
+        assert len(asyncio.run(run())) == LLM_CONCURRENCY * 3
+        assert llm.calls == LLM_CONCURRENCY * 3
+        assert 1 <= llm.peak <= LLM_CONCURRENCY
+    
+    def test_timed_out_call_keeps_its_slot(self):
+        """Test that a timed-out LLM call holds its slot until it actually finishes."""
+        release = threading.Event()
+        blocked = AsyncQueryService(FakeRetriever(), llm=ConcurrencyRecordingLLM(release=release))
+        blocked.timeouts["generate"] = 0.1
+        
+        async def fill_slots():
+            return await asyncio.gather(
+                *[blocked.aquery(f"Blocked {i}") for i in range(LLM_CONCURRENCY)], return_exceptions=True
+            )
+        
+        assert all(isinstance(result, TimeoutError) for result in asyncio.run(fill_slots()))
+        
+        # A different service shares the process-wide slots, so it must wait
+        waiting = AsyncQueryService(FakeRetriever(), llm=FakeLLM())
+        waiting.timeouts["generate"] = 0.1
+        with pytest.raises(TimeoutError):
+            asyncio.run(waiting.aquery("What is my fit score?"))
+        
+        release.set()
+        waiting.timeouts["generate"] = 5
+        assert asyncio.run(waiting.aquery("What is my fit score?"))["result"] == "You know Python."
+    
+    def test_identical_queries_coalesced_across_threads(self):
+        """Test that sessions on different threads and event loops share one execution."""
+        llm = ConcurrencyRecordingLLM(delay=0.3)
+        service = AsyncQueryService(FakeRetriever(), llm=llm)
+        barrier = threading.Barrier(2)
+        results = []
+        
+        def session():
+            barrier.wait()
+            results.append(asyncio.run(service.aquery("Which job is the best fit?")))
+        
+        threads = [threading.Thread(target=session) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert len(results) == 2
+        assert results[0] is results[1]
+        assert llm.calls == 1
+
+
 class TestDocumentIngestion:
     """Test document ingestion pipeline."""
     
@@ -97,6 +363,187 @@ class TestDocumentIngestion:
         assert len(results) > 0
 
 
+class TestIndexSnapshot:
+    """Test the versioned index snapshot."""
+    
+    @pytest.fixture
+    def splits(self):
+        return [
+            Document(page_content="Skills: Python, SQL", metadata={"source_type": "resume", "section": "full"}),
+            Document(page_content="Requirements: Python, Docker", metadata={
+                "source_type": "job_description", "job_id": 1, "filename": "job1.md", "section": "Requirements"
+            }),
+        ]
+    
+    def test_snapshot_roundtrip(self, splits, tmp_path):
+        """Test that the manifest and auxiliary structures are written and reloaded."""
+        manifest = write_index_snapshot(splits, EMBEDDINGS_MODEL, 1024, str(tmp_path))
+        snapshot = load_index_snapshot(str(tmp_path))
+        assert snapshot["manifest"] == manifest
+        assert snapshot["manifest"]["embedding_dim"] == 1024
+        assert snapshot["aux"]["source_counts"] == {"resume": 1, "job_description": 1}
+        assert check_index_snapshot(manifest, 2) is None
+    
+    def test_snapshot_missing(self, tmp_path):
+        """Test that a directory without a snapshot returns None."""
+        assert load_index_snapshot(str(tmp_path)) is None
+    
+    def test_snapshot_detects_mismatches(self, splits, tmp_path):
+        """Test that model and chunk-count mismatches are reported."""
+        manifest = write_index_snapshot(splits, "some-other-model", 768, str(tmp_path))
+        assert "re-ingest" in check_index_snapshot(manifest, 2)
+        manifest["embedding_model"] = EMBEDDINGS_MODEL
+        assert "re-ingest" in check_index_snapshot(manifest, 5)
+    
+    def test_snapshot_detects_dimension_mismatch(self, splits, tmp_path):
+        """Test that query vectors of the wrong dimension are reported."""
+        manifest = write_index_snapshot(splits, EMBEDDINGS_MODEL, 1024, str(tmp_path))
+        assert check_embedding_dim(manifest, 1024) is None
+        assert "re-ingest" in check_embedding_dim(manifest, 384)
+        
+        retriever = SimpleChromaRetriever(
+            collection=None, embeddings=FakeEmbeddings(), snapshot={"manifest": manifest, "aux": {}}
+        )
+        with pytest.raises(ValueError):
+            retriever.get_relevant_documents("Python skills")
+
+
+class TestJobDigests:
+    """Test cached per-job digests."""
+    
+    @pytest.fixture
+    def job_docs(self):
+        return [
+            Document(page_content="Skills: Python", metadata={"source_type": "resume"}),
+            Document(page_content="Senior ML Engineer, page 1", metadata={
+                "source_type": "job_description", "job_id": 1, "filename": "job1.pdf"
+            }),
+            Document(page_content="Requirements: 5+ years Python", metadata={
+                "source_type": "job_description", "job_id": 1, "filename": "job1.pdf"
+            }),
+            Document(page_content="Full Stack Developer", metadata={
+                "source_type": "job_description", "job_id": 2, "filename": "job2.txt"
+            }),
+        ]
+    
+    def test_comparative_question_detection(self):
+        """Test that comparative and aggregate questions are recognised."""
+        assert is_comparative_question("Compare Job 1 and Job 4")
+        assert is_comparative_question("What are the common requirements across all jobs?")
+        assert is_comparative_question("Which job is the best fit for my profile?")
+        assert is_comparative_question("Job 1 vs. Job 2: which pays more?")
+        assert not is_comparative_question("What is my fit score for Job 1?")
+    
+    def test_single_job_questions_are_not_comparative(self):
+        """Test that single-job questions using comparative words keep raw chunks."""
+        for question in [
+            "What common interview questions should I prepare for Job 1?",
+            "How do I come across in the ML role interview?",
+            "Rank my skills for Job 2",
+            "What is the best fit score for job 3",
+            "Compare my skills with Job 2",
+        ]:
+            assert not is_comparative_question(question), question
+    
+    def test_digests_are_built_per_job_and_cached(self, job_docs, tmp_path):
+        """Test one digest per job, reused until the job content changes."""
+        llm = CountingDigestLLM()
+        digests = build_job_digests(job_docs, llm=llm, persist_dir=str(tmp_path))
+        assert [digest["job_id"] for digest in digests] == [1, 2]
+        assert digests[0]["required_skills"] == ["Python", "PyTorch"]
+        assert digests[0]["nice_to_have_skills"] == ["Docker", "AWS"]
+        assert llm.calls == 2
+        
+        build_job_digests(job_docs, llm=llm, persist_dir=str(tmp_path))
+        assert llm.calls == 2
+        
+        job_docs[3].page_content = "Full Stack Developer (React)"
+        build_job_digests(job_docs, llm=llm, persist_dir=str(tmp_path))
+        assert llm.calls == 3
+        assert len(load_job_digests(str(tmp_path))) == 2
+    
+    def test_digests_ignored_for_other_snapshot(self, job_docs, tmp_path):
+        """Test that digests from a different corpus are not loaded next to a new index."""
+        build_job_digests(job_docs, llm=CountingDigestLLM(), persist_dir=str(tmp_path), corpus_hash="old-corpus")
+        assert len(load_job_digests(str(tmp_path), corpus_hash="old-corpus")) == 2
+        assert load_job_digests(str(tmp_path), corpus_hash="new-corpus") == []
+        
+        # The per-job cache is still reused when the new corpus rebuilds digests
+        llm = CountingDigestLLM()
+        build_job_digests(job_docs, llm=llm, persist_dir=str(tmp_path), corpus_hash="new-corpus")
+        assert llm.calls == 0
+        assert len(load_job_digests(str(tmp_path), corpus_hash="new-corpus")) == 2
+    
+    def test_failed_digest_is_kept_and_retried(self, job_docs, tmp_path):
+        """Test that a failed summary is recorded and retried on the next build."""
+        digests = build_job_digests(job_docs, llm=FailingDigestLLM(), persist_dir=str(tmp_path))
+        assert [digest["summarized"] for digest in digests] == [False, False]
+        
+        llm = CountingDigestLLM()
+        digests = build_job_digests(job_docs, llm=llm, persist_dir=str(tmp_path))
+        assert llm.calls == 2
+        assert all(digest["summarized"] for digest in digests)
+    
+    def test_comparative_query_falls_back_to_raw_chunks(self, job_docs, tmp_path):
+        """Test that jobs without a digest contribute their raw chunks."""
+        digests = build_job_digests(job_docs, llm=CountingDigestLLM(), persist_dir=str(tmp_path))
+        digests[1] = {**digests[1], "summarized": False}
+        collection = RecordingCollection()
+        retriever = SimpleChromaRetriever(collection=collection, embeddings=FakeEmbeddings(), job_digests=digests)
+        
+        docs = retriever.get_relevant_documents("Compare Job 1 and Job 2")
+        assert [doc.metadata["source_type"] for doc in docs] == ["job_digest", "job_description", "job_description"]
+        job_filter = collection.queries[0]["$and"]
+        assert {"job_id": 2} in job_filter and {"filename": "job2.txt"} in job_filter
+        assert collection.queries[1] == {"source_type": "resume"}
+    
+    @staticmethod
+    def make_digests(count, unsummarized=()):
+        return [
+            {
+                "job_id": job_id, "filename": f"job{job_id}.md", "url": None, "content_hash": str(job_id),
+                "summarized": job_id not in unsummarized, "title": f"Role {job_id}",
+            }
+            for job_id in range(1, count + 1)
+        ]
+    
+    def test_comparative_query_uses_only_referenced_jobs(self):
+        """Test that only the jobs named in the question reach the context."""
+        collection = RecordingCollection()
+        retriever = SimpleChromaRetriever(
+            collection=collection, embeddings=FakeEmbeddings(), job_digests=self.make_digests(8, unsummarized=(4, 6))
+        )
+        
+        docs = retriever.get_relevant_documents("Compare Job 1 and Job 4")
+        assert [doc.metadata.get("job_id") for doc in docs if doc.metadata["source_type"] == "job_digest"] == [1]
+        assert len(collection.queries) == 2
+        assert {"job_id": 4} in collection.queries[0]["$and"]
+        assert collection.queries[1] == {"source_type": "resume"}
+    
+    def test_aggregate_query_falls_back_to_top_k(self):
+        """Test that too many jobs, or mostly unsummarized ones, use normal retrieval."""
+        collection = RecordingCollection()
+        retriever = SimpleChromaRetriever(collection=collection, embeddings=FakeEmbeddings(), job_digests=self.make_digests(40))
+        docs = retriever.get_relevant_documents("What are the common requirements across all jobs?")
+        assert collection.queries == [None]
+        assert len(docs) == 1
+        
+        collection = RecordingCollection()
+        retriever = SimpleChromaRetriever(
+            collection=collection, embeddings=FakeEmbeddings(), job_digests=self.make_digests(4, unsummarized=(1, 2, 3))
+        )
+        retriever.get_relevant_documents("Which job is the best fit for my profile?")
+        assert collection.queries == [None]
+    
+    def test_job_digest_document(self, job_docs, tmp_path):
+        """Test that digests render as compact job_digest documents."""
+        digest = build_job_digests(job_docs, llm=CountingDigestLLM(), persist_dir=str(tmp_path))[0]
+        doc = job_digest_document(digest)
+        assert doc.metadata["source_type"] == "job_digest"
+        assert "Required skills: Python, PyTorch" in doc.page_content
+        assert "Years of experience: 5+" in doc.page_content
+
+
 class TestRAGChain:
     """Test RAG chain creation and invocation."""
     